@@ -9,15 +9,42 @@ Author: Mia 🌸 | Date: 2026-03-05
 
 import json
 import os
+import selectors
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.util.retry import Retry
 
 OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
 MODEL = os.environ.get("OLLAMA_MODEL", "qwen3-coder-next")
 MAX_TURNS = int(os.environ.get("MAX_TURNS", "30"))
 MAX_TOKENS = int(os.environ.get("MAX_TOKENS", "4096"))
+STREAM = os.environ.get("STREAM", "1") != "0"
+STREAM_IDLE_TIMEOUT = int(os.environ.get("STREAM_IDLE_TIMEOUT", "120"))  # max silence between chunks
+GENERATION_TIMEOUT = 300  # 5 min timeout for generation
+CONTEXT_BUDGET = int(os.environ.get("CONTEXT_BUDGET", "24000"))  # est. prompt tokens per request
+KEEP_RECENT_TURNS = int(os.environ.get("KEEP_RECENT_TURNS", "3"))  # turns always sent verbatim
+NUM_CTX = int(os.environ.get("NUM_CTX", "32768"))  # fixed num_ctx; 0 = size per session (single subject only)
+TOOL_WORKERS = int(os.environ.get("TOOL_WORKERS", "4"))  # parallel read-only tool calls
+RECORD = os.environ.get("RECORD", "")  # cassette path: append each /api/chat exchange
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")  # stdout view: text | jsonl
+TRANSCRIPT = os.environ.get("TRANSCRIPT", "")  # optional JSONL transcript file (appended)
+COMMAND_TIMEOUT = 30  # seconds per run_command
+COMMAND_HEAD_BYTES = int(os.environ.get("COMMAND_HEAD_BYTES", "6000"))  # stdout kept from the start
+COMMAND_TAIL_BYTES = int(os.environ.get("COMMAND_TAIL_BYTES", "4000"))  # stdout kept from the end
+COMMAND_OUTPUT_CEILING = int(os.environ.get("COMMAND_OUTPUT_CEILING", str(64 * 1024 * 1024)))  # kill above this
+COMMAND_CPU_SECONDS = int(os.environ.get("COMMAND_CPU_SECONDS", "60"))  # RLIMIT_CPU per process; 0 = off
+COMMAND_MEMORY_MB = int(os.environ.get("COMMAND_MEMORY_MB", "2048"))  # RLIMIT_AS per process; 0 = off
+COMMAND_NPROC = int(os.environ.get("COMMAND_NPROC", "0"))  # RLIMIT_NPROC, counted per UID host-wide, not per container; 0 = off (compose pids limit)
+PID_FILE = os.environ.get("PID_FILE", "")  # written while a session runs, for trigger-session's watchdog
 
 # ── Tool Definitions ──────────────────────────────────────────
 
@@ -26,11 +53,15 @@ TOOLS = [
         "type": "function",
         "function": {
             "name": "read_file",
-            "description": "Read the contents of a file in the workspace. Use relative paths from the workspace root.",
+            "description": "Read the contents of a file in the workspace. Use relative paths from the workspace root. "
+                           "Large files are returned a window at a time; the result says how to read the next one.",
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "path": {"type": "string", "description": "Relative path to the file"}
+                    "path": {"type": "string", "description": "Relative path to the file"},
+                    "offset": {"type": "integer", "description": "First line (or byte) to read, counting from 0 (default: 0)"},
+                    "limit": {"type": "integer", "description": "Max lines (or bytes) to read (default: 2000 lines)"},
+                    "unit": {"type": "string", "enum": ["lines", "bytes"], "description": "What offset/limit count (default: lines)"}
                 },
                 "required": ["path"]
             }
@@ -82,6 +113,314 @@ TOOLS = [
 ]
 
 
+# ── File Reading ──────────────────────────────────────────────
+# read_file returns one bounded window of a file, read straight from disk:
+# at most READ_MAX_BYTES per call however big the file is. Small files come
+# back whole and unchanged; otherwise a footer gives the file size and the
+# offset to continue from. infrastructure/agent/self-improve.py carries the
+# same read_window (each agent is a standalone script): keep them in step.
+
+READ_MAX_BYTES = 50000  # per call
+READ_DEFAULT_LINES = 2000
+BINARY_SNIFF_BYTES = 8192
+
+
+def looks_binary(head: bytes) -> bool:
+    """NUL bytes or mostly control characters in the first block."""
+    if b"\0" in head:
+        return True
+    if not head:
+        return False
+    control = sum(1 for b in head if b < 32 and b not in (9, 10, 12, 13, 27))
+    return control / len(head) > 0.3
+
+
+def _skip_lines(f, n: int):
+    skipped = 0
+    while skipped < n:
+        chunk = f.readline(READ_MAX_BYTES)  # bounded even for huge single lines
+        if not chunk:
+            break
+        if chunk.endswith(b"\n"):
+            skipped += 1
+
+
+def read_window(real: str, offset: int = 0, limit: int = 0, unit: str = "lines") -> str:
+    """Read one window of the file at real. offset/limit count lines or bytes."""
+    size = os.path.getsize(real)
+    offset = max(0, int(offset or 0))
+    with open(real, "rb") as f:
+        if looks_binary(f.read(BINARY_SNIFF_BYTES)):
+            return f"(binary file, {size} bytes — not shown)"
+        f.seek(0)
+
+        if unit == "bytes":
+            f.seek(offset)
+            data = f.read(max(1, min(int(limit or READ_MAX_BYTES), READ_MAX_BYTES)))
+            end = offset + len(data)
+            if not data and offset:
+                return f"(offset {offset} is past the end of this {size}-byte file)"
+            shown = f"bytes {offset}-{end}"
+            next_args = f"offset={end}, unit=\"bytes\""
+        else:
+            limit = max(1, int(limit or READ_DEFAULT_LINES))
+            _skip_lines(f, offset)
+            chunks, used, complete = [], 0, 0
+            while complete < limit and used < READ_MAX_BYTES:
+                chunk = f.readline(READ_MAX_BYTES - used)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                used += len(chunk)
+                complete += chunk.endswith(b"\n")
+            data = b"".join(chunks)
+            end = f.tell()
+            if not data and offset:
+                return f"(offset {offset} is past the last line of this {size}-byte file)"
+            shown = f"lines {offset + 1}-{offset + complete}" if complete else f"part of line {offset + 1}"
+            next_args = f"offset={offset + complete}"
+            if chunks and not chunks[-1].endswith(b"\n"):
+                next_args += f" (this line continues: offset={end}, unit=\"bytes\")"
+
+    text = data.decode("utf-8", errors="replace")
+    more = end < size
+    if not more and offset == 0:
+        return text
+    if more:
+        return f"{text}\n[... {shown} of a {size}-byte file shown; more remains — read_file with {next_args}]"
+    return f"{text}\n[{shown} of a {size}-byte file shown; end of file]"
+
+
+# ── Command Execution ─────────────────────────────────────────
+# run_command reads stdout and stderr as they are produced and keeps only a
+# head and a tail of each (stderr gets half of stdout's budget), so memory
+# stays bounded whatever the command prints. A command that writes more than
+# COMMAND_OUTPUT_CEILING bytes in total is killed early, like one that runs
+# past COMMAND_TIMEOUT.
+#
+# The shell is not started from this process but from COMMAND_SUPERVISOR, a
+# small `python3 -I -S` helper that applies the CPU, address-space and
+# process-count rlimits, spawns `sh -c` in its own process group and reaps
+# it with wait4. It is also the subreaper for everything the shell starts, so
+# background jobs and children orphaned by a kill are reaped (and their CPU
+# counted) there too. On Linux a spawned process starts with its parent's
+# peak RSS, so spawning from the agent itself would report the agent's
+# footprint for `true`; from the helper, anything at or below the helper's
+# own peak is reported as "≤ floor". The helper writes the shell's pid and,
+# when done, its usage to a report file.
+
+class BoundedCapture:
+    """The first `head` and last `tail` bytes of a stream, plus a count of the rest."""
+
+    def __init__(self, head: int, tail: int):
+        self.head_max = head
+        self.tail_max = tail
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def feed(self, data: bytes):
+        self.total += len(data)
+        room = self.head_max - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data and self.tail_max:
+            self.tail += data
+            if len(self.tail) > self.tail_max:
+                del self.tail[:len(self.tail) - self.tail_max]
+
+    @property
+    def dropped(self) -> int:
+        return self.total - len(self.head) - len(self.tail)
+
+    def text(self) -> str:
+        head = self.head.decode("utf-8", errors="replace")
+        tail = self.tail.decode("utf-8", errors="replace")
+        if self.dropped:
+            return f"{head}\n[... {self.dropped} bytes of output dropped ...]\n{tail}"
+        return head + tail
+
+
+# argv: <command> <report fd> <RLIMIT_CPU s> <RLIMIT_AS bytes> <RLIMIT_NPROC> (0 = off).
+# Kept in step with the copy in infrastructure/agent/self-improve.py.
+COMMAND_SUPERVISOR = r"""
+import os, resource, sys, time
+command, report = sys.argv[1], int(sys.argv[2])
+for limit, value in zip((resource.RLIMIT_CPU, resource.RLIMIT_AS, resource.RLIMIT_NPROC),
+                        map(int, sys.argv[3:6])):
+    if value:
+        hard = resource.getrlimit(limit)[1]
+        resource.setrlimit(limit, (value if hard == resource.RLIM_INFINITY else min(value, hard), hard))
+try:
+    import ctypes
+    ctypes.CDLL(None).prctl(36, 1, 0, 0, 0)  # PR_SET_CHILD_SUBREAPER
+except Exception:
+    pass
+os.set_inheritable(report, False)
+with open("/proc/self/status") as status:  # not ru_maxrss: that still holds the agent's peak
+    floor = next(int(line.split()[1]) for line in status if line.startswith("VmHWM:"))
+pid = os.posix_spawn("/bin/sh", ["sh", "-c", command], os.environ, setsid=True)
+os.write(report, f"pid {pid}\n".encode())
+cpu, rss, code, settle = 0.0, 0, None, None
+while True:
+    try:
+        child, status, usage = os.wait4(-1, 0 if code is None else os.WNOHANG)
+    except ChildProcessError:
+        break
+    if child:
+        cpu += usage.ru_utime + usage.ru_stime
+        rss = max(rss, usage.ru_maxrss)
+        if child == pid:
+            code = os.waitstatus_to_exitcode(status)
+            # a killed group's other members land here a moment after the shell
+            settle = time.monotonic() + (0.2 if code < 0 else 0)
+    elif time.monotonic() >= settle:
+        break
+    else:
+        time.sleep(0.01)
+os.write(report, f"usage {code} {cpu:.3f} {rss} {floor}\n".encode())
+os._exit(code if code >= 0 else 128 - code)
+"""
+
+
+def _start_command(command: str, cwd: str, **kwargs) -> tuple:
+    """Popen the supervisor for `command`. Returns (proc, report file)."""
+    report = tempfile.TemporaryFile()
+    proc = subprocess.Popen(
+        [sys.executable, "-I", "-S", "-c", COMMAND_SUPERVISOR, command, str(report.fileno()),
+         str(COMMAND_CPU_SECONDS), str(COMMAND_MEMORY_MB * 1024 * 1024), str(COMMAND_NPROC)],
+        cwd=cwd,
+        pass_fds=(report.fileno(),),
+        start_new_session=True,
+        **kwargs,
+    )
+    return proc, report
+
+
+def _read_report(report) -> dict:
+    """{"pid": shell pid, "usage": (exit code, cpu s, peak RSS KB, floor KB)}, as far as written."""
+    fields = {}
+    for line in os.pread(report.fileno(), 4096, 0).decode().splitlines():
+        key, *values = line.split()
+        if key == "pid":
+            fields["pid"] = int(values[0])
+        elif key == "usage" and values[0] != "None":
+            fields["usage"] = (int(values[0]), float(values[1]), int(values[2]), int(values[3]))
+    return fields
+
+
+def _kill_command(proc: subprocess.Popen, report):
+    """SIGKILL the command's process group; the supervisor reaps it and reports."""
+    pid = _read_report(report).get("pid")
+    if pid is None:  # still starting: stop the supervisor, then anything it got to spawn
+        proc.kill()
+        proc.wait()
+        pid = _read_report(report).get("pid")
+    if pid is not None:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+def _wait_supervisor(proc: subprocess.Popen, timeout: float = 5):
+    """Wait for the supervisor to finish reporting; kill it if it hangs."""
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def _signal_note(returncode: int) -> str:
+    """' — SIGXCPU (CPU time limit)' etc. for a process (or a shell's child) killed by a signal."""
+    signum = -returncode if returncode < 0 else returncode - 128
+    try:
+        name = signal.Signals(signum).name
+    except ValueError:
+        return ""
+    return f" — {name}" + (" (CPU time limit)" if name == "SIGXCPU" else "")
+
+
+def _format_usage(wall: float, usage) -> str:
+    """The [wall | cpu | peak RSS] footer; usage is _read_report's tuple or None."""
+    if usage is None:
+        return f"[wall {wall:.2f}s | cpu ? | peak RSS ?]"
+    _, cpu, rss, floor = usage  # ru_maxrss is in KB on Linux
+    peak = f"≤ {floor / 1024:.1f}" if rss <= floor else f"{rss / 1024:.1f}"
+    return f"[wall {wall:.2f}s | cpu {cpu:.2f}s | peak RSS {peak} MB]"
+
+
+def run_command(command: str, workspace: str) -> str:
+    """Run a shell command in the workspace with bounded output capture."""
+    out = BoundedCapture(COMMAND_HEAD_BYTES, COMMAND_TAIL_BYTES)
+    err = BoundedCapture(COMMAND_HEAD_BYTES // 2, COMMAND_TAIL_BYTES // 2)
+    proc, report = _start_command(
+        command,
+        workspace,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env={**os.environ, "HOME": workspace},
+    )
+    with report:
+        try:
+            return _collect_command(proc, report, out, err)
+        except BaseException:
+            _kill_command(proc, report)  # session cancelled mid-command: take the command down too
+            _wait_supervisor(proc)
+            raise
+
+
+def _collect_command(proc: subprocess.Popen, report, out: BoundedCapture, err: BoundedCapture) -> str:
+    start = time.monotonic()
+    deadline = start + COMMAND_TIMEOUT
+    killed = None
+    with selectors.DefaultSelector() as sel:
+        sel.register(proc.stdout, selectors.EVENT_READ, out)
+        sel.register(proc.stderr, selectors.EVENT_READ, err)
+        while sel.get_map() and not killed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                killed = f"timed out ({COMMAND_TIMEOUT}s limit)"
+                break
+            for key, _ in sel.select(remaining):
+                data = os.read(key.fd, 65536)
+                if not data:
+                    sel.unregister(key.fileobj)
+                    continue
+                key.data.feed(data)
+            if out.total + err.total > COMMAND_OUTPUT_CEILING:
+                killed = f"output exceeded {COMMAND_OUTPUT_CEILING} bytes"
+
+    if not killed:
+        try:
+            proc.wait(timeout=max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            killed = f"timed out ({COMMAND_TIMEOUT}s limit)"
+    if killed:
+        _kill_command(proc, report)
+        _wait_supervisor(proc)
+    proc.stdout.close()
+    proc.stderr.close()
+    wall = time.monotonic() - start
+    usage = _read_report(report).get("usage")
+    returncode = usage[0] if usage else proc.returncode
+
+    output = ""
+    if out.total:
+        output += out.text()
+    if err.total:
+        output += f"\nSTDERR: {err.text()}"
+    if killed:
+        output += f"\nERROR: Command killed: {killed}"
+    elif returncode != 0:
+        output += f"\n(exit code: {returncode}{_signal_note(returncode)})"
+    output = output.strip() or "(no output)"
+    return f"{output}\n{_format_usage(wall, usage)}"
+
+
 # ── Tool Execution ────────────────────────────────────────────
 
 def execute_tool(name: str, args: dict, workspace: str) -> str:
@@ -95,9 +434,9 @@ def execute_tool(name: str, args: dict, workspace: str) -> str:
                 return "ERROR: Cannot read files outside workspace"
             if not os.path.exists(real):
                 return f"ERROR: File not found: {args['path']}"
-            with open(real, "r") as f:
-                content = f.read()
-            return content[:50000]  # Cap at 50K chars
+            if os.path.isdir(real):
+                return f"ERROR: Is a directory: {args['path']}"
+            return read_window(real, args.get("offset", 0), args.get("limit", 0), args.get("unit", "lines"))
 
         elif name == "write_file":
             path = os.path.join(workspace, args["path"])
@@ -125,126 +464,630 @@ def execute_tool(name: str, args: dict, workspace: str) -> str:
             return "\n".join(entries) if entries else "(empty directory)"
 
         elif name == "run_command":
-            # Security: run in workspace, limit time
-            result = subprocess.run(
-                args["command"],
-                shell=True,
-                cwd=workspace,
-                capture_output=True,
-                text=True,
-                timeout=30,
-                env={**os.environ, "HOME": workspace}
-            )
-            output = ""
-            if result.stdout:
-                output += result.stdout[:10000]
-            if result.stderr:
-                output += f"\nSTDERR: {result.stderr[:5000]}"
-            if result.returncode != 0:
-                output += f"\n(exit code: {result.returncode})"
-            return output.strip() or "(no output)"
+            return run_command(args["command"], workspace)
 
         else:
             return f"ERROR: Unknown tool: {name}"
 
-    except subprocess.TimeoutExpired:
-        return "ERROR: Command timed out (30s limit)"
     except Exception as e:
         return f"ERROR: {type(e).__name__}: {e}"
 
 
+# Tools with no side effects on the workspace. Consecutive read-only calls in
+# one turn run concurrently; any other tool is a barrier and runs alone, in
+# the order the model issued it, so a read after a write still sees the write.
+READ_ONLY_TOOLS = {"read_file", "list_directory"}
+
+
+def execute_tools(calls: list, workspace: str) -> list:
+    """Execute a turn's [(name, args), ...] and return results in the same order."""
+    results = [None] * len(calls)
+    i = 0
+    pool = None
+    try:
+        while i < len(calls):
+            j = i
+            while j < len(calls) and calls[j][0] in READ_ONLY_TOOLS:
+                j += 1
+            if j - i > 1:
+                pool = pool or ThreadPoolExecutor(max_workers=max(1, TOOL_WORKERS))
+                futures = [pool.submit(execute_tool, name, args, workspace) for name, args in calls[i:j]]
+                for k, fut in enumerate(futures):
+                    results[i + k] = fut.result()
+                i = j
+            else:
+                name, args = calls[i]
+                results[i] = execute_tool(name, args, workspace)
+                i += 1
+    finally:
+        if pool:
+            pool.shutdown()
+    return results
+
+
+# ── HTTP Session ──────────────────────────────────────────────
+# One keep-alive connection to Ollama for the whole session instead of a
+# fresh TCP handshake per turn. Connect time is recorded per request so
+# network latency can be told apart from Ollama-side latency.
+
+_http_stats = threading.local()
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """HTTPConnection that records how long its TCP connect took."""
+
+    def connect(self):
+        start = time.time()
+        super().connect()
+        _http_stats.connect_time = time.time() - start
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter whose plain-HTTP pools use TimedHTTPConnection."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            **self.poolmanager.pool_classes_by_scheme,
+            "http": TimedHTTPConnectionPool,
+        }
+
+
+def make_http_session() -> requests.Session:
+    """Shared session with a small keep-alive pool.
+
+    Connection failures are retried (the request never reached Ollama), and so
+    are read errors on idempotent methods. A POST to /api/chat that fails
+    after it was sent is NOT retried — that would silently re-run a generation.
+    """
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=2,
+        status=0,
+        backoff_factor=0.5,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,  # excludes POST
+    )
+    adapter = PooledAdapter(pool_connections=1, pool_maxsize=4, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+HTTP = make_http_session()
+
+
+def post_chat(payload: dict, **kwargs):
+    """POST /api/chat on the shared session. Returns (response, connect_seconds).
+
+    connect_seconds is None when a pooled connection was reused.
+    """
+    _http_stats.connect_time = None
+    resp = HTTP.post(f"{OLLAMA_URL}/api/chat", json=payload, **kwargs)
+    return resp, _http_stats.connect_time
+
+
+def format_http_stats(stats: dict) -> str:
+    connect = stats.get("connect")
+    parts = ["connect " + ("reused" if connect is None else f"{connect * 1000:.1f}ms")]
+    if stats.get("response") is not None:
+        parts.append(f"response {stats['response']:.2f}s")
+    if stats.get("ttft") is not None:
+        parts.append(f"ttft {stats['ttft']:.2f}s")
+    parts.append(f"total {stats['total']:.2f}s")
+    return " | ".join(parts)
+
+
+# ── Context Management ────────────────────────────────────────
+# The full history is kept in `messages`, but each request sends a view of
+# it trimmed to CONTEXT_BUDGET: the system prompt, the user prompt and the
+# last KEEP_RECENT_TURNS turns go verbatim; older tool results (up to 50K
+# chars each from read_file) are shrunk, then elided, and as a last resort
+# older assistant text is shortened. Without this every turn re-sends the
+# whole session and prompt-eval time keeps growing.
+
+CHARS_PER_TOKEN = 3.5  # rough estimate; no tokenizer inside the container
+STALE_RESULT_CHARS = 800  # head of an old tool result kept on the first pass
+STALE_ASSISTANT_CHARS = 300
+TOOLS_TOKENS = int(len(json.dumps(TOOLS)) / CHARS_PER_TOKEN)
+
+
+def estimate_tokens(msg: dict) -> int:
+    chars = len(msg.get("content") or "")
+    if msg.get("tool_calls"):
+        chars += len(json.dumps(msg["tool_calls"]))
+    return int(chars / CHARS_PER_TOKEN) + 4  # + per-message template overhead
+
+
+def _shrink(text: str, keep: int, what: str) -> str:
+    if len(text) <= keep:
+        return text
+    return (f"{text[:keep]}\n[... {len(text) - keep} more chars of this {what} elided from an "
+            f"earlier turn to save context — call the tool again if you need them]")
+
+
+def build_context(messages: list) -> tuple:
+    """Return (messages to send, stats) fitted to CONTEXT_BUDGET where possible."""
+    assistant_idx = [i for i, m in enumerate(messages) if m.get("role") == "assistant"]
+    if len(assistant_idx) > KEEP_RECENT_TURNS:
+        recent_start = assistant_idx[-KEEP_RECENT_TURNS] if KEEP_RECENT_TURNS else len(messages)
+    else:
+        recent_start = len(messages)
+
+    context = [dict(m) for m in messages]
+    sizes = [estimate_tokens(m) for m in context]
+    total = TOOLS_TOKENS + sum(sizes)
+    stats = {"shrunk": 0, "elided": 0, "trimmed": 0}
+
+    stale = range(2, min(recent_start, len(context)))  # never touch system + user prompt
+    passes = [
+        ("tool", "shrunk", lambda t: _shrink(t, STALE_RESULT_CHARS, "tool result")),
+        ("tool", "elided", lambda t: f"[tool result elided to save context: {len(t)} chars]"),
+        ("assistant", "trimmed", lambda t: _shrink(t, STALE_ASSISTANT_CHARS, "message")),
+    ]
+    for role, stat, reduce in passes:
+        for i in stale:
+            if total <= CONTEXT_BUDGET:
+                break
+            m = context[i]
+            if m.get("role") != role or not m.get("content"):
+                continue
+            # Elide from the original text so the marker reports the real size
+            reduced = reduce(messages[i]["content"] if stat == "elided" else m["content"])
+            if len(reduced) >= len(m["content"]):
+                continue
+            m["content"] = reduced
+            new_size = estimate_tokens(m)
+            total -= sizes[i] - new_size
+            sizes[i] = new_size
+            stats[stat] += 1
+
+    stats["tokens"] = total
+    return context, stats
+
+
+def size_num_ctx(prompt_tokens: int, current: int = 0) -> int:
+    """NUM_CTX, or with NUM_CTX=0 the smallest power-of-two window that fits
+    the prompt plus MAX_TOKENS of output.
+
+    Ollama reloads the model whenever num_ctx changes. Subjects sharing one
+    Ollama in parallel must all send the same value, so it is pinned by
+    default (32768 covers CONTEXT_BUDGET + MAX_TOKENS). Per-session sizing is
+    opt-in for a single subject: the size only ever grows within a session
+    and moves in coarse steps.
+    """
+    if NUM_CTX:
+        return NUM_CTX
+    needed = int((prompt_tokens + MAX_TOKENS) * 1.1)
+    size = 4096
+    while size < needed:
+        size *= 2
+    return max(size, current)
+
+
+# ── Model Calls ───────────────────────────────────────────────
+
+def chat(messages: list, num_ctx: int = 0, label: str = "") -> tuple:
+    """Call /api/chat once. Returns (response dict, timing stats).
+
+    label prefixes the streamed text echoed to stderr (see chat_stream).
+
+    Timing stats: connect (TCP connect seconds, None if reused), response
+    (request sent → response headers), ttft (streaming only) and total.
+    """
+    payload = {
+        "model": MODEL,
+        "messages": messages,
+        "tools": TOOLS,
+        "stream": STREAM,
+        "options": {
+            "num_predict": MAX_TOKENS,
+            "temperature": 0.7
+        }
+    }
+    if num_ctx:
+        payload["options"]["num_ctx"] = num_ctx
+    if STREAM:
+        data, stats = chat_stream(payload, label)
+    else:
+        start = time.time()
+        resp, connect = post_chat(payload, timeout=GENERATION_TIMEOUT)
+        resp.raise_for_status()
+        data = resp.json()
+        stats = {
+            "connect": connect,
+            "response": resp.elapsed.total_seconds(),
+            "ttft": None,
+            "total": time.time() - start,
+        }
+    if RECORD:
+        record_exchange(payload, data, stats)
+    return data, stats
+
+
+def record_exchange(payload: dict, data: dict, stats: dict):
+    """Append one request/response pair to the RECORD cassette (JSON lines).
+
+    Streamed responses are stored assembled, in the non-streaming shape;
+    mock_ollama.py re-chunks them on replay.
+    """
+    with open(RECORD, "a") as f:
+        f.write(json.dumps({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "request": payload,
+            "response": data,
+            "timing": {"ttft": stats["ttft"], "total": stats["total"]},
+        }) + "\n")
+
+
+def chat_stream(payload: dict, label: str = "") -> tuple:
+    """Consume Ollama's NDJSON chunk stream and assemble it into one response.
+
+    Content deltas are echoed to stderr as they arrive (trigger-session redirects
+    it into the session log), so a stalled generation shows up within
+    STREAM_IDLE_TIMEOUT seconds instead of at the 5-minute mark. The echo is
+    one line, started with `label` at the first delta and always ended, even
+    when the request fails, so it never runs into the next transcript line. Tool calls arrive
+    as whole objects in one or more chunks and are concatenated in order. The
+    returned dict has the same shape as a non-streaming response: the final
+    ``done`` chunk's metrics plus the assembled ``message``.
+    """
+    start = time.time()
+    ttft = None
+    content_parts = []
+    tool_calls = []
+    final = {}
+
+    resp, connect = post_chat(payload, stream=True, timeout=(10, STREAM_IDLE_TIMEOUT))
+    try:
+        with resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise RuntimeError(chunk["error"])
+
+                msg = chunk.get("message", {})
+                delta = msg.get("content", "")
+                if ttft is None and (delta or msg.get("tool_calls")):
+                    ttft = time.time() - start
+                if delta:
+                    if not content_parts:
+                        sys.stderr.write(label)
+                    content_parts.append(delta)
+                    sys.stderr.write(delta)
+                    sys.stderr.flush()
+                tool_calls.extend(msg.get("tool_calls") or [])
+
+                if chunk.get("done"):
+                    # Keep reading to the end of the body so the connection
+                    # goes back to the pool instead of being discarded.
+                    final = chunk
+                    continue
+                if time.time() - start > GENERATION_TIMEOUT:
+                    raise TimeoutError(f"Generation exceeded {GENERATION_TIMEOUT}s")
+    finally:
+        if content_parts:
+            sys.stderr.write("\n")
+            sys.stderr.flush()
+
+    message = {"role": "assistant", "content": "".join(content_parts)}
+    if tool_calls:
+        message["tool_calls"] = tool_calls
+    final["message"] = message
+    return final, {
+        "connect": connect,
+        "response": resp.elapsed.total_seconds(),
+        "ttft": ttft,
+        "total": time.time() - start,
+    }
+
+
+# ── Telemetry ─────────────────────────────────────────────────
+# One METRICS line per turn, as JSON, in the session log. trigger-session
+# copies them into <log>.metrics.jsonl; metrics-report.py aggregates them.
+
+OLLAMA_DURATIONS = ["prompt_eval_duration", "eval_duration", "load_duration", "total_duration"]
+
+
+def turn_metrics(turn: int, data: dict, http_stats: dict, ctx_stats: dict,
+                 num_ctx: int, tool_seconds: float, tool_count: int) -> dict:
+    """Ollama's per-response counters (durations converted from ns to s) plus our own timings."""
+    record = {
+        "turn": turn,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "model": MODEL,
+        "prompt_eval_count": data.get("prompt_eval_count"),
+        "eval_count": data.get("eval_count"),
+    }
+    for key in OLLAMA_DURATIONS:
+        ns = data.get(key)
+        record[f"{key}_s"] = ns / 1e9 if ns is not None else None
+    record.update({
+        "request_s": round(http_stats["total"], 3),
+        "ttft_s": round(http_stats["ttft"], 3) if http_stats.get("ttft") is not None else None,
+        "connect_s": round(http_stats["connect"], 4) if http_stats.get("connect") is not None else None,
+        "tool_s": round(tool_seconds, 3),
+        "tool_calls": tool_count,
+        "num_ctx": num_ctx,
+        "ctx_tokens_est": ctx_stats["tokens"],
+    })
+    return record
+
+
+# ── Transcript ────────────────────────────────────────────────
+# The session is written event by event as it happens, not returned at the
+# end, so a watchdog kill keeps everything up to the last event and memory
+# stays flat however long the session runs. Each event is a JSON object;
+# the text view is one rendering of it (the classic session log format).
+
+def render_event(event: dict) -> str:
+    """Text-view line(s) for one transcript event."""
+    kind = event["type"]
+    if kind == "session_start":
+        return (f"=== Session Start: {event['time']} ===\n"
+                f"Model: {event['model']}\n"
+                f"Workspace: {event['workspace']}\n"
+                f"Prompt: {event['prompt'][:200]}...\n")
+    if kind == "turn":
+        return f"--- Turn {event['turn']}/{event['max_turns']} ---"
+    if kind == "api_error":
+        return f"API ERROR: {event['error']}"
+    if kind == "http":
+        return f"HTTP: {format_http_stats(event['stats'])}"
+    if kind == "context":
+        c = event["stats"]
+        return (f"CONTEXT: ~{c['tokens']:,} tokens est. | num_ctx {event['num_ctx']} | "
+                f"stale results shrunk {c['shrunk']}, elided {c['elided']}, "
+                f"messages trimmed {c['trimmed']}")
+    if kind == "assistant":
+        return f"ASSISTANT: {event['content'][:2000]}"
+    if kind == "tool_call":
+        return f"TOOL CALL: {event['name']}({json.dumps(event['args'])[:500]})"
+    if kind == "tool_result":
+        return f"TOOL RESULT ({event['name']}): {event['result'][:1000]}"
+    if kind == "metrics":
+        return "METRICS: " + json.dumps(event["record"])
+    if kind == "complete":
+        return "(No tool calls — session complete)"
+    if kind == "max_turns":
+        return f"(Max turns {event['max_turns']} reached)"
+    if kind == "cancelled":
+        return f"(Session cancelled at turn {event['turn']})"
+    if kind == "session_end":
+        return (f"\n=== Session End: {event['time']} ===\n"
+                f"Turns used: {event['turns']}/{event['max_turns']}")
+    return f"{kind.upper()}: {json.dumps(event)}"
+
+
+class Transcript:
+    """Writes each session event to one or more (stream, "text"|"jsonl") sinks.
+
+    Every event is flushed as soon as it is written. write_seconds is the
+    total time spent formatting and writing, for the benchmark.
+    """
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+        self.write_seconds = 0.0
+
+    def event(self, kind: str, **fields):
+        start = time.perf_counter()
+        record = {"type": kind, "ts": round(time.time(), 3), **fields}
+        for stream, fmt in self.sinks:
+            if fmt == "jsonl":
+                stream.write(json.dumps(record) + "\n")
+            else:
+                stream.write(render_event(record) + "\n")
+            stream.flush()
+        self.write_seconds += time.perf_counter() - start
+
+
+def read_transcript(path: str):
+    """Yield the events of a JSONL transcript. Lines that aren't complete JSON
+    objects (a write cut off by a kill, stray stderr) are skipped."""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(event, dict) and "type" in event:
+                yield event
+
+
+# ── Cancellation ──────────────────────────────────────────────
+# trigger-session's watchdog stops an overrunning session by sending SIGTERM
+# to the PID in PID_FILE. The handler raises SessionCancelled wherever the
+# loop is: a streaming chat() closes its connection (Ollama stops generating
+# when the client goes away), a running command's process group is killed,
+# and the transcript records the cancellation before the process exits.
+
+class SessionCancelled(BaseException):
+    """Raised by the SIGTERM handler. A BaseException so tool error handling can't swallow it."""
+
+
+def _cancel(signum, frame):
+    raise SessionCancelled(signal.Signals(signum).name)
+
+
+def write_pid_file():
+    if PID_FILE:
+        with open(PID_FILE, "w") as f:
+            f.write(f"{os.getpid()}\n")
+
+
+def remove_pid_file():
+    try:
+        with open(PID_FILE) as f:
+            if f.read().strip() == str(os.getpid()):
+                os.remove(PID_FILE)
+    except OSError:
+        pass
+
+
 # ── Main Agent Loop ───────────────────────────────────────────
 
-def run_session(workspace: str, system_prompt: str, user_prompt: str) -> str:
-    """Run one agentic session. Returns the full conversation log."""
+def run_session(workspace: str, system_prompt: str, user_prompt: str, transcript: Transcript) -> int:
+    """Run one agentic session, writing it to transcript as it goes. Returns turns used.
+
+    On SessionCancelled the transcript is closed off and SessionCancelled re-raised.
+    """
 
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
 
-    log_lines = []
-    log_lines.append(f"=== Session Start: {time.strftime('%Y-%m-%dT%H:%M:%S%z')} ===")
-    log_lines.append(f"Model: {MODEL}")
-    log_lines.append(f"Workspace: {workspace}")
-    log_lines.append(f"Prompt: {user_prompt[:200]}...")
-    log_lines.append("")
+    transcript.event("session_start", time=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                     model=MODEL, workspace=workspace, prompt=user_prompt)
 
-    for turn in range(MAX_TURNS):
-        log_lines.append(f"--- Turn {turn + 1}/{MAX_TURNS} ---")
+    num_ctx = 0
+    turn = 0
+    cancelled = False
+    try:
+        for turn in range(MAX_TURNS):
+            transcript.event("turn", turn=turn + 1, max_turns=MAX_TURNS)
 
-        try:
-            resp = requests.post(
-                f"{OLLAMA_URL}/api/chat",
-                json={
-                    "model": MODEL,
-                    "messages": messages,
-                    "tools": TOOLS,
-                    "stream": False,
-                    "options": {
-                        "num_predict": MAX_TOKENS,
-                        "temperature": 0.7
-                    }
-                },
-                timeout=300  # 5 min timeout for generation
-            )
-            resp.raise_for_status()
-            data = resp.json()
-        except Exception as e:
-            log_lines.append(f"API ERROR: {e}")
-            break
+            try:
+                context, ctx_stats = build_context(messages)
+                num_ctx = size_num_ctx(ctx_stats["tokens"], num_ctx)
+                data, http_stats = chat(context, num_ctx, label=f"[stream] turn {turn + 1}: ")
+            except Exception as e:
+                transcript.event("api_error", error=str(e))
+                break
 
-        msg = data.get("message", {})
-        content = msg.get("content", "")
-        tool_calls = msg.get("tool_calls", [])
+            transcript.event("http", stats=http_stats)
+            transcript.event("context", stats=ctx_stats, num_ctx=num_ctx)
 
-        # Log assistant response
-        if content:
-            log_lines.append(f"ASSISTANT: {content[:2000]}")
+            msg = data.get("message", {})
+            content = msg.get("content", "")
+            tool_calls = msg.get("tool_calls", [])
 
-        # Add assistant message to conversation
-        messages.append(msg)
+            # Log assistant response
+            if content:
+                transcript.event("assistant", content=content)
 
-        # If no tool calls, we're done
-        if not tool_calls:
-            log_lines.append("(No tool calls — session complete)")
-            break
+            # Add assistant message to conversation
+            messages.append(msg)
 
-        # Execute each tool call
-        for tc in tool_calls:
-            func = tc.get("function", {})
-            name = func.get("name", "")
-            try:
-                args = json.loads(func.get("arguments", "{}")) if isinstance(func.get("arguments"), str) else func.get("arguments", {})
-            except json.JSONDecodeError:
-                args = {}
+            # If no tool calls, we're done
+            if not tool_calls:
+                transcript.event("metrics", record=turn_metrics(
+                    turn + 1, data, http_stats, ctx_stats, num_ctx, 0.0, 0))
+                transcript.event("complete")
+                break
 
-            log_lines.append(f"TOOL CALL: {name}({json.dumps(args)[:500]})")
+            # Execute the turn's tool calls (read-only ones concurrently)
+            tool_start = time.time()
+            calls = []
+            for tc in tool_calls:
+                func = tc.get("function", {})
+                name = func.get("name", "")
+                try:
+                    args = json.loads(func.get("arguments", "{}")) if isinstance(func.get("arguments"), str) else func.get("arguments", {})
+                except json.JSONDecodeError:
+                    args = {}
+                calls.append((name, args))
 
-            result = execute_tool(name, args, workspace)
-            log_lines.append(f"TOOL RESULT: {result[:1000]}")
+            # Calls are on record before they run, so a session killed
+            # mid-command still shows what it was running
+            for name, args in calls:
+                transcript.event("tool_call", name=name, args=args)
+            results = execute_tools(calls, workspace)
 
-            # Add tool result to conversation
-            messages.append({
-                "role": "tool",
-                "content": result
-            })
+            for (name, args), result in zip(calls, results):
+                transcript.event("tool_result", name=name, result=result)
 
-    else:
-        log_lines.append(f"(Max turns {MAX_TURNS} reached)")
+                # Add tool result to conversation
+                messages.append({
+                    "role": "tool",
+                    "content": result
+                })
 
-    log_lines.append(f"\n=== Session End: {time.strftime('%Y-%m-%dT%H:%M:%S%z')} ===")
-    log_lines.append(f"Turns used: {turn + 1}/{MAX_TURNS}")
+            transcript.event("metrics", record=turn_metrics(
+                turn + 1, data, http_stats, ctx_stats, num_ctx,
+                time.time() - tool_start, len(tool_calls)))
+
+        else:
+            transcript.event("max_turns", max_turns=MAX_TURNS)
+    except SessionCancelled as e:
+        transcript.event("cancelled", turn=turn + 1, signal=str(e))
+        cancelled = True
+
+    transcript.event("session_end", time=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                     turns=turn + 1, max_turns=MAX_TURNS)
+    if cancelled:
+        raise SessionCancelled("session cancelled")
+    return turn + 1
 
-    return "\n".join(log_lines)
+
+# ── Tool Server ───────────────────────────────────────────────
+
+def serve_tools(workspace: str):
+    """Execute tool calls for a host-side runner (async_runner.py).
+
+    Reads one JSON request per stdin line — {"calls": [[name, args], ...]} —
+    and answers each with one line {"results": [...]}. Exits at EOF, which is
+    what the runner's `docker exec -i` client produces when it closes. A
+    cancelled session's server is stopped through PID_FILE instead, since
+    EOF only arrives once the tool call in progress has finished.
+    """
+    for line in sys.stdin:
+        try:
+            calls = [tuple(c) for c in json.loads(line)["calls"]]
+        except (ValueError, KeyError, TypeError) as e:
+            reply = {"error": f"Bad request: {e}"}
+        else:
+            reply = {"results": execute_tools(calls, workspace)}
+        sys.stdout.write(json.dumps(reply) + "\n")
+        sys.stdout.flush()
 
 
 # ── Entry Point ───────────────────────────────────────────────
 
+SYSTEM_PROMPT = (
+    "You are an AI agent with a persistent workspace. You can read and write files, "
+    "list directories, and run shell commands. Your workspace persists between sessions — "
+    "what you write will be there next time you wake up. Start by reading your SOUL.md "
+    "and any other files that exist. They define who you are."
+)
+
 if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--serve-tools":
+        # Stoppable like a session: async_runner SIGTERMs it via PID_FILE on
+        # timeout, which also takes down a command it is running
+        signal.signal(signal.SIGTERM, _cancel)
+        write_pid_file()
+        try:
+            serve_tools(os.path.abspath(sys.argv[2]))
+        except SessionCancelled:
+            sys.exit(128 + signal.SIGTERM)
+        finally:
+            remove_pid_file()
+        sys.exit(0)
+
+    if len(sys.argv) == 3 and sys.argv[1] == "--render":
+        for event in read_transcript(sys.argv[2]):
+            print(render_event(event))
+        sys.exit(0)
+
     if len(sys.argv) < 3:
         print("Usage: agent_loop.py <workspace_path> <prompt>")
-        print("  Optional env: OLLAMA_URL, OLLAMA_MODEL, MAX_TURNS, MAX_TOKENS")
+        print("       agent_loop.py --serve-tools <workspace_path>")
+        print("       agent_loop.py --render <transcript.jsonl>")
+        print("  Optional env: OLLAMA_URL, OLLAMA_MODEL, MAX_TURNS, MAX_TOKENS, STREAM, STREAM_IDLE_TIMEOUT,")
+        print("                CONTEXT_BUDGET, KEEP_RECENT_TURNS, NUM_CTX, TOOL_WORKERS, RECORD,")
+        print("                LOG_FORMAT, TRANSCRIPT, COMMAND_HEAD_BYTES, COMMAND_TAIL_BYTES,")
+        print("                COMMAND_OUTPUT_CEILING, COMMAND_CPU_SECONDS, COMMAND_MEMORY_MB, COMMAND_NPROC,")
+        print("                PID_FILE")
         sys.exit(1)
 
     workspace = os.path.abspath(sys.argv[1])
@@ -254,12 +1097,17 @@ if __name__ == "__main__":
         print(f"ERROR: Workspace not found: {workspace}")
         sys.exit(1)
 
-    system_prompt = (
-        "You are an AI agent with a persistent workspace. You can read and write files, "
-        "list directories, and run shell commands. Your workspace persists between sessions — "
-        "what you write will be there next time you wake up. Start by reading your SOUL.md "
-        "and any other files that exist. They define who you are."
-    )
-
-    log = run_session(workspace, system_prompt, prompt)
-    print(log)
+    sinks = [(sys.stdout, "jsonl" if LOG_FORMAT == "jsonl" else "text")]
+    transcript_file = open(TRANSCRIPT, "a") if TRANSCRIPT else None
+    if transcript_file:
+        sinks.append((transcript_file, "jsonl"))
+    signal.signal(signal.SIGTERM, _cancel)
+    write_pid_file()
+    try:
+        run_session(workspace, SYSTEM_PROMPT, prompt, Transcript(*sinks))
+    except SessionCancelled:
+        sys.exit(128 + signal.SIGTERM)
+    finally:
+        remove_pid_file()
+        if transcript_file:
+            transcript_file.close()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+RSI-011 Async Runner — many agent sessions in one host process.
+Drives every subject's agent loop from a single asyncio event loop instead of
+one `docker exec ... agent_loop.py` interpreter per subject. Model calls go
+to Ollama over non-blocking HTTP from the host; tool calls are still executed
+inside each subject's own container (via `agent_loop.py --serve-tools`), so
+isolation is unchanged.
+
+Backpressure: at most MAX_INFLIGHT chat requests are sent to Ollama at once
+(match OLLAMA_NUM_PARALLEL); sessions waiting on the model hold no slot while
+they run tools. Each session is its own task and is cancelled on timeout —
+cancelling closes its Ollama connection (Ollama aborts the generation) and
+its tool channel.
+
+Used by trigger-session.py when RUNNER=async. Needs agent_loop.py's
+dependencies (requests) on the host, since it reuses its helpers.
+
+Author: Mia 🌸 | Date: 2026-03-05
+"""
+
+import asyncio
+import json
+import os
+import time
+import urllib.parse
+
+import agent_loop
+
+STREAM_LIMIT = 16 * 1024 * 1024  # max bytes per NDJSON / tool-server line
+
+
+# ── Non-blocking Ollama client ──────────────────────────────
+
+async def _read_body(reader, headers, idle_timeout):
+    """Yield raw body bytes, handling chunked and Content-Length responses."""
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        while True:
+            size_line = await asyncio.wait_for(reader.readline(), idle_timeout)
+            size = int(size_line.split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                return
+            data = await asyncio.wait_for(reader.readexactly(size + 2), idle_timeout)
+            yield data[:-2]
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining > 0:
+            data = await asyncio.wait_for(reader.read(min(remaining, 65536)), idle_timeout)
+            if not data:
+                return
+            remaining -= len(data)
+            yield data
+    else:
+        while True:
+            data = await asyncio.wait_for(reader.read(65536), idle_timeout)
+            if not data:
+                return
+            yield data
+
+
+async def post_ndjson(url, payload, idle_timeout, stats=None):
+    """POST JSON to url and yield each NDJSON object of the response as it arrives.
+
+    A gap of more than idle_timeout seconds between reads raises TimeoutError.
+    Closing the generator (or cancelling the task) closes the socket. If
+    given, stats gets the connect and response (request sent → status line)
+    times in seconds, as agent_loop.chat reports them.
+    """
+    stats = {} if stats is None else stats
+    parts = urllib.parse.urlsplit(url)
+    start = time.time()
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(parts.hostname, parts.port or 80, limit=STREAM_LIMIT), 10
+    )
+    stats["connect"] = time.time() - start
+    try:
+        body = json.dumps(payload).encode()
+        writer.write(
+            f"POST {parts.path or '/'} HTTP/1.1\r\n"
+            f"Host: {parts.netloc}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+        sent = time.time()
+
+        status_line = await asyncio.wait_for(reader.readline(), idle_timeout)
+        stats["response"] = time.time() - sent
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), idle_timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        buffer = b""
+        async for data in _read_body(reader, headers, idle_timeout):
+            buffer += data
+            if status != 200:
+                continue
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        if status != 200:
+            raise RuntimeError(f"HTTP {status}: {buffer[:500].decode(errors='replace')}")
+        if buffer.strip():
+            yield json.loads(buffer)
+    finally:
+        writer.close()
+
+
+async def chat(url, payload):
+    """Streamed /api/chat call assembled like agent_loop.chat_stream. Returns (data, stats)."""
+    start = time.time()
+    ttft = None
+    content_parts = []
+    tool_calls = []
+    final = {}
+    http_stats = {"connect": None, "response": None}
+    stream = post_ndjson(f"{url}/api/chat", {**payload, "stream": True},
+                         agent_loop.STREAM_IDLE_TIMEOUT, http_stats)
+    try:
+        async for chunk in stream:
+            if chunk.get("error"):
+                raise RuntimeError(chunk["error"])
+            msg = chunk.get("message", {})
+            delta = msg.get("content", "")
+            if ttft is None and (delta or msg.get("tool_calls")):
+                ttft = time.time() - start
+            if delta:
+                content_parts.append(delta)
+            tool_calls.extend(msg.get("tool_calls") or [])
+            if chunk.get("done"):
+                final = chunk
+            if time.time() - start > agent_loop.GENERATION_TIMEOUT:
+                raise TimeoutError(f"Generation exceeded {agent_loop.GENERATION_TIMEOUT}s")
+    finally:
+        await stream.aclose()
+
+    message = {"role": "assistant", "content": "".join(content_parts)}
+    if tool_calls:
+        message["tool_calls"] = tool_calls
+    final["message"] = message
+    return final, {**http_stats, "ttft": ttft, "total": time.time() - start}
+
+
+# ── In-container tool channel ───────────────────────────────
+
+class ToolChannel:
+    """A long-lived `agent_loop.py --serve-tools` process inside one container.
+
+    With pid_file and stop_agent (trigger-session's in-container supervisor,
+    stop_agent(container) -> str), an aborted session also stops the tool
+    server and any command it is running, not just the host-side client.
+    """
+
+    def __init__(self, container, pid_file=None, stop_agent=None):
+        self.container = container
+        self.pid_file = pid_file
+        self.stop_agent = stop_agent
+        self.proc = None
+
+    async def start(self):
+        env = ["-e", f"PID_FILE={self.pid_file}"] if self.pid_file else []
+        self.proc = await asyncio.create_subprocess_exec(
+            "docker", "exec", "-i", "--user", "subject", *env, self.container,
+            "python3", "/opt/agent_loop.py", "--serve-tools", "/workspace",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL, limit=STREAM_LIMIT
+        )
+
+    async def run(self, calls):
+        """Execute [(name, args), ...] in the container; results in call order."""
+        self.proc.stdin.write((json.dumps({"calls": calls}) + "\n").encode())
+        await self.proc.stdin.drain()
+        line = await self.proc.stdout.readline()
+        if not line:
+            raise RuntimeError(f"Tool server in {self.container} exited")
+        reply = json.loads(line)
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply["results"]
+
+    async def close(self, abort=False):
+        """Shut the tool server down: EOF on a clean finish, stop_agent when
+        aborting (timeout, cancellation, error) or when EOF goes unanswered.
+        Returns the stop_agent outcome, or None if it was not needed."""
+        if not self.proc or self.proc.returncode is not None:
+            return None
+        stop = None
+        if abort and self.stop_agent:
+            stop = await asyncio.to_thread(self.stop_agent, self.container)
+        try:
+            self.proc.stdin.close()
+            await asyncio.wait_for(self.proc.wait(), 5)
+        except (asyncio.TimeoutError, ConnectionError):
+            if self.stop_agent and stop is None:
+                stop = await asyncio.to_thread(self.stop_agent, self.container)
+            self.proc.kill()
+            await self.proc.wait()
+        return stop
+
+
+# ── One session ─────────────────────────────────────────────
+
+async def run_session(container, prompt, log_file, model, url, max_turns, inflight,
+                      num_ctx_setting=agent_loop.NUM_CTX, pid_file=None, stop_agent=None):
+    """The agent_loop.run_session loop, with awaits at the model and tool calls.
+
+    Writes the usual text log to log_file and the JSONL transcript next to it
+    (<log>.jsonl), event by event. num_ctx_setting is the num_ctx every
+    session of the round sends (0 = size per session). pid_file and
+    stop_agent are passed to the ToolChannel. Returns turns used.
+    """
+    messages = [
+        {"role": "system", "content": agent_loop.SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+    channel = ToolChannel(container, pid_file, stop_agent)
+
+    with open(log_file, "w") as log, open(log_file[:-len(".log")] + ".jsonl", "w") as jsonl:
+        transcript = agent_loop.Transcript((log, "text"), (jsonl, "jsonl"))
+        transcript.event("session_start", time=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                         model=model, workspace="/workspace", prompt=prompt)
+
+        await channel.start()
+        num_ctx = 0
+        turn = 0
+        aborted = True
+        try:
+            for turn in range(max_turns):
+                transcript.event("turn", turn=turn + 1, max_turns=max_turns)
+                context, ctx_stats = agent_loop.build_context(messages)
+                num_ctx = num_ctx_setting or agent_loop.size_num_ctx(ctx_stats["tokens"], num_ctx)
+                payload = {
+                    "model": model,
+                    "messages": context,
+                    "tools": agent_loop.TOOLS,
+                    "options": {
+                        "num_predict": agent_loop.MAX_TOKENS,
+                        "temperature": 0.7,
+                        "num_ctx": num_ctx
+                    }
+                }
+                try:
+                    async with inflight:
+                        data, http_stats = await chat(url, payload)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    transcript.event("api_error", error=f"{type(e).__name__}: {e}")
+                    break
+
+                transcript.event("http", stats=http_stats)
+                transcript.event("context", stats=ctx_stats, num_ctx=num_ctx)
+
+                msg = data.get("message", {})
+                content = msg.get("content", "")
+                tool_calls = msg.get("tool_calls", [])
+                if content:
+                    transcript.event("assistant", content=content)
+                messages.append(msg)
+
+                calls = []
+                for tc in tool_calls:
+                    func = tc.get("function", {})
+                    args = func.get("arguments", {})
+                    if isinstance(args, str):
+                        try:
+                            args = json.loads(args)
+                        except json.JSONDecodeError:
+                            args = {}
+                    calls.append((func.get("name", ""), args))
+
+                tool_start = time.time()
+                for name, args in calls:
+                    transcript.event("tool_call", name=name, args=args)
+                results = await channel.run(calls) if calls else []
+                for (name, args), result in zip(calls, results):
+                    transcript.event("tool_result", name=name, result=result)
+                    messages.append({"role": "tool", "content": result})
+
+                record = agent_loop.turn_metrics(turn + 1, data, http_stats, ctx_stats, num_ctx,
+                                                 time.time() - tool_start, len(calls))
+                transcript.event("metrics", record={**record, "model": model})
+                if not calls:
+                    transcript.event("complete")
+                    break
+            else:
+                transcript.event("max_turns", max_turns=max_turns)
+            aborted = False
+        except asyncio.CancelledError:
+            transcript.event("cancelled", turn=turn + 1)
+            raise
+        finally:
+            await channel.close(abort=aborted)
+            transcript.event("session_end", time=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                             turns=turn + 1, max_turns=max_turns)
+
+    return turn + 1
+
+
+# ── A whole round ───────────────────────────────────────────
+
+async def _run_round(jobs, model, url, max_turns, max_inflight, timeout, on_done, num_ctx,
+                     pid_file, stop_agent):
+    inflight = asyncio.Semaphore(max(1, max_inflight))
+
+    async def one(job):
+        start = time.time()
+        status, exit_code = "done", 0
+        try:
+            await asyncio.wait_for(
+                run_session(job["container"], job["prompt"], job["log_file"],
+                            model, url, max_turns, inflight, num_ctx, pid_file, stop_agent),
+                timeout
+            )
+        except asyncio.TimeoutError:
+            status, exit_code = "timeout", 124
+        except Exception as e:
+            status, exit_code = "failed", 1
+            with open(job["log_file"], "a") as log:
+                log.write(f"RUNNER ERROR: {type(e).__name__}: {e}\n")
+        result = {"subject": job["subject"], "status": status, "exit_code": exit_code,
+                  "duration": int(time.time() - start), "log_file": job["log_file"]}
+        try:
+            result["size"] = os.path.getsize(job["log_file"])
+        except OSError:
+            result["size"] = 0
+        on_done(result)
+        return result
+
+    return await asyncio.gather(*(one(job) for job in jobs))
+
+
+def run_round(jobs, model, url, max_turns, max_inflight, timeout, on_done=lambda r: None,
+              num_ctx=agent_loop.NUM_CTX, pid_file=None, stop_agent=None):
+    """Run all jobs ({subject, container, prompt, log_file}) in one event loop.
+
+    Every session starts immediately; model requests are throttled to
+    max_inflight. All sessions send the same num_ctx, so parallel requests
+    never force Ollama to reload the model. A session that times out or fails
+    has its in-container tool server stopped with stop_agent (see ToolChannel).
+    Returns result dicts in job order.
+    """
+    return asyncio.run(_run_round(jobs, model, url, max_turns, max_inflight, timeout, on_done, num_ctx,
+                                  pid_file, stop_agent))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+RSI-011 Agent Loop Benchmark — Measures agent_loop.py itself, offline.
+Runs N sessions in-process against mock_ollama.py in scratch workspaces and
+reports turns/s, tool latency and the loop's own overhead (context building,
+parsing, transcript writes) separately from model time. Needs no GPU or model.
+
+Usage: bench-agent-loop.py [--sessions N] [--json]
+                           [--cassette file.jsonl | --script file.json]
+                           [--speed F] [--ttft S] [--tok-s N]
+
+--speed defaults to 0 (no model latency) so results isolate the loop; use
+--speed 1 with a cassette to replay recorded timings instead.
+
+Author: Mia 🌸 | Date: 2026-03-05
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import mock_ollama  # noqa: E402
+
+SEED_FILES = {
+    "SOUL.md": "# SOUL\n\nI am a benchmark subject.\n" + "I value clarity. " * 200 + "\n",
+    "AGENTS.md": "# AGENTS\n\nTools: read_file, write_file, list_directory, run_command.\n",
+}
+PROMPT = "Read your SOUL.md and AGENTS.md, then write a journal entry in journal.md."
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_one(agent_loop, scratch):
+    """One session in a fresh workspace. Returns its measurements."""
+    workspace = tempfile.mkdtemp(dir=scratch)
+    for name, content in SEED_FILES.items():
+        with open(os.path.join(workspace, name), "w") as f:
+            f.write(content)
+
+    log_path = os.path.join(scratch, "session.log")
+    stderr = sys.stderr
+    with open(os.path.join(scratch, "stream.txt"), "w") as stream_out, open(log_path, "w") as log:
+        sys.stderr = stream_out  # streamed deltas, as trigger-session captures them
+        transcript = agent_loop.Transcript((log, "text"))
+        try:
+            start = time.perf_counter()
+            agent_loop.run_session(workspace, agent_loop.SYSTEM_PROMPT, PROMPT, transcript)
+            wall = time.perf_counter() - start
+        finally:
+            sys.stderr = stderr
+
+    with open(log_path) as f:
+        metrics = [json.loads(line[len("METRICS: "):]) for line in f if line.startswith("METRICS: ")]
+    shutil.rmtree(workspace, ignore_errors=True)
+    model_s = sum(m["request_s"] or 0 for m in metrics)
+    tool_s = sum(m["tool_s"] or 0 for m in metrics)
+    return {
+        "wall_s": wall,
+        "turns": len(metrics),
+        "tool_calls": sum(m["tool_calls"] for m in metrics),
+        "turn_tool_s": [m["tool_s"] for m in metrics if m["tool_calls"]],
+        "model_s": model_s,
+        "tool_s": tool_s,
+        "overhead_s": max(0.0, wall - model_s - tool_s),
+        "log_write_s": transcript.write_seconds,
+        "log_bytes": os.path.getsize(log_path),
+    }
+
+
+def summarize(runs):
+    turns = sum(r["turns"] for r in runs)
+    wall = sum(r["wall_s"] for r in runs)
+    calls = sum(r["tool_calls"] for r in runs)
+    tool_s = sum(r["tool_s"] for r in runs)
+    turn_tool_s = [t for r in runs for t in r["turn_tool_s"]]
+    p95 = percentile(turn_tool_s, 95)
+    return {
+        "sessions": len(runs),
+        "turns": turns,
+        "turns_per_s": round(turns / wall, 1) if wall else None,
+        "session_ms": round(wall / len(runs) * 1000, 1),
+        "tool_ms_per_call": round(tool_s / calls * 1000, 2) if calls else None,
+        "tool_ms_per_turn_p95": round(p95 * 1000, 2) if p95 is not None else None,
+        "model_ms_per_turn": round(sum(r["model_s"] for r in runs) / turns * 1000, 2) if turns else None,
+        "loop_overhead_ms_per_turn": round(sum(r["overhead_s"] for r in runs) / turns * 1000, 2) if turns else None,
+        "log_write_ms": round(sum(r["log_write_s"] for r in runs) / len(runs) * 1000, 3),
+        "log_kb": round(sum(r["log_bytes"] for r in runs) / len(runs) / 1024, 1),
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    as_json = "--json" in args
+    args = [a for a in args if a != "--json"]
+    sessions = 5
+    if "--sessions" in args:
+        i = args.index("--sessions")
+        sessions = int(args[i + 1])
+        del args[i:i + 2]
+    if "--speed" not in args:
+        args += ["--speed", "0"]
+    responder, kwargs = mock_ollama.parse_responder_args(args)
+
+    server = mock_ollama.make_server(responder, port=0, **kwargs)
+    os.environ["OLLAMA_URL"] = mock_ollama.serve_in_background(server)
+    import agent_loop  # reads OLLAMA_URL at import
+
+    scratch = tempfile.mkdtemp(prefix="bench-agent-loop-")
+    try:
+        run_one(agent_loop, scratch)  # warm-up: imports, connection pool
+        runs = [run_one(agent_loop, scratch) for _ in range(sessions)]
+    finally:
+        server.shutdown()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report = summarize(runs)
+    if as_json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print(f"=== agent_loop benchmark: {type(responder).__name__}, speed {kwargs['speed']} ===")
+    for key, value in report.items():
+        print(f"  {key:<26} {'—' if value is None else value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
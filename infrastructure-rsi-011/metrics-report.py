@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+RSI-011 Metrics Report — Aggregates per-turn Ollama telemetry.
+Reads the <log>.metrics.jsonl files that trigger-session writes next to each
+session log and reports generation speed, prompt-eval share and model
+reloads per subject and per round.
+
+Usage: metrics-report.py [--round last|<round_id>] [--json] [data_dir]
+
+Author: Mia 🌸 | Date: 2026-03-05
+"""
+
+import glob
+import json
+import os
+import sys
+from collections import defaultdict
+
+DATA_DIR = "/Users/miguelitodeguzman/ailab/lab-protocol/experiments/rsi-011/data"
+RELOAD_THRESHOLD_S = 1.0  # load_duration above this means Ollama (re)loaded the model
+
+
+def load_records(data_dir):
+    records = []
+    for path in sorted(glob.glob(os.path.join(data_dir, "*.metrics.jsonl"))):
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+
+def _sum(records, key):
+    return sum(r.get(key) or 0 for r in records)
+
+
+def summarize(records):
+    """Aggregate a group of per-turn records into one summary dict."""
+    eval_tokens = _sum(records, "eval_count")
+    eval_s = _sum(records, "eval_duration_s")
+    prompt_tokens = _sum(records, "prompt_eval_count")
+    prompt_s = _sum(records, "prompt_eval_duration_s")
+    total_s = _sum(records, "total_duration_s")
+    ttfts = [r["ttft_s"] for r in records if r.get("ttft_s") is not None]
+    return {
+        "turns": len(records),
+        "eval_tokens": eval_tokens,
+        "prompt_tokens": prompt_tokens,
+        "gen_tok_s": round(eval_tokens / eval_s, 1) if eval_s else None,
+        "prompt_tok_s": round(prompt_tokens / prompt_s, 1) if prompt_s else None,
+        "prompt_eval_share": round(prompt_s / total_s, 3) if total_s else None,
+        "reloads": sum(1 for r in records if (r.get("load_duration_s") or 0) > RELOAD_THRESHOLD_S),
+        "request_s": round(_sum(records, "request_s"), 1),
+        "tool_s": round(_sum(records, "tool_s"), 1),
+        "max_ttft_s": round(max(ttfts), 2) if ttfts else None,
+    }
+
+
+def group_by(records, key):
+    groups = defaultdict(list)
+    for r in records:
+        groups[r.get(key, "?")].append(r)
+    return {k: summarize(v) for k, v in sorted(groups.items())}
+
+
+def fmt(v, suffix=""):
+    return "—" if v is None else f"{v}{suffix}"
+
+
+def print_table(title, summaries):
+    print(f"\n{title}")
+    print(f"  {'':<40} {'turns':>5} {'gen tok/s':>9} {'prompt tok/s':>12} "
+          f"{'prompt %':>8} {'reloads':>7} {'request s':>9} {'tool s':>7} {'max ttft':>8}")
+    for name, s in summaries.items():
+        share = None if s["prompt_eval_share"] is None else round(s["prompt_eval_share"] * 100, 1)
+        print(f"  {name:<40} {s['turns']:>5} {fmt(s['gen_tok_s']):>9} {fmt(s['prompt_tok_s']):>12} "
+              f"{fmt(share, '%'):>8} {s['reloads']:>7} {s['request_s']:>9} {s['tool_s']:>7} "
+              f"{fmt(s['max_ttft_s'], 's'):>8}")
+
+
+def main():
+    args = sys.argv[1:]
+    as_json = "--json" in args
+    round_filter = None
+    if "--round" in args:
+        i = args.index("--round")
+        round_filter = args[i + 1] if i + 1 < len(args) else "last"
+        del args[i:i + 2]
+    args = [a for a in args if a != "--json"]
+    data_dir = args[0] if args else DATA_DIR
+
+    records = load_records(data_dir)
+    if round_filter == "last" and records:
+        round_filter = max(records, key=lambda r: r.get("time", "")).get("round")
+    if round_filter:
+        records = [r for r in records if r.get("round") == round_filter]
+    if not records:
+        print("No metrics records found")
+        return 1
+
+    report = {
+        "by_round": group_by(records, "round"),
+        "by_subject": group_by(records, "subject"),
+        "overall": summarize(records),
+    }
+    if as_json:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    print_table("Per round", report["by_round"])
+    print_table("Per subject", report["by_subject"])
+    print_table("Overall", {"all": report["overall"]})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+RSI-011 Mock Ollama — Offline /api/chat server for exercising agent_loop.py.
+Serves either a recorded cassette (RECORD=<file> in agent_loop.py) or a
+synthesized tool-call script, streamed or not, with model-like latency:
+a prompt phase before the first token, then a steady token rate.
+
+Usage: mock_ollama.py [--port 11434] [--cassette file.jsonl | --script file.json]
+                      [--speed F] [--ttft S] [--tok-s N]
+
+Replay matches each request to the recorded response for the same session
+(first user message) and turn (assistant messages so far); unmatched requests
+get a plain final answer so the loop ends. Latency defaults to the recorded
+Ollama durations; --speed scales them (0 = no delay), --ttft/--tok-s override.
+
+A script is a JSON list of turns: {"content": str, "tool_calls": [[name, args], ...]}.
+Without --cassette or --script the built-in DEFAULT_SCRIPT is served.
+
+Author: Mia 🌸 | Date: 2026-03-05
+"""
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHARS_PER_TOKEN = 3.5  # same estimate as agent_loop.py
+SCRIPT_TTFT = 0.5      # seconds before the first token of a synthesized turn
+SCRIPT_TOK_S = 30.0    # synthesized generation speed
+
+DEFAULT_SCRIPT = [
+    {"content": "Let me look around first.",
+     "tool_calls": [["list_directory", {"path": "."}], ["read_file", {"path": "SOUL.md"}],
+                    ["read_file", {"path": "AGENTS.md"}]]},
+    {"content": "I'll check the environment.",
+     "tool_calls": [["run_command", {"command": "ls -la && wc -c *.md"}]]},
+    {"content": "Now I'll record my reflection.",
+     "tool_calls": [["write_file", {"path": "journal.md",
+                                    "content": "# Journal\n\nBenchmark session entry.\n"}]]},
+    {"content": "Session complete. I read my files and wrote a journal entry.", "tool_calls": []},
+]
+
+
+def _tokens(text):
+    return max(1, int(len(text) / CHARS_PER_TOKEN))
+
+
+def _session_key(messages):
+    """(first user message, assistant turns so far) — stable across replays."""
+    first_user = next((m.get("content", "") for m in messages if m.get("role") == "user"), "")
+    return first_user, sum(1 for m in messages if m.get("role") == "assistant")
+
+
+# ── Responders ────────────────────────────────────────────────
+
+class CassetteResponder:
+    """Replays the responses of a RECORD cassette."""
+
+    def __init__(self, path):
+        self.by_session = {}
+        self.by_turn = {}
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                key = _session_key(entry["request"]["messages"])
+                self.by_session.setdefault(key, entry["response"])
+                self.by_turn.setdefault(key[1], entry["response"])
+
+    def respond(self, payload):
+        key = _session_key(payload.get("messages", []))
+        data = self.by_session.get(key) or self.by_turn.get(key[1])
+        if data is None:
+            return {"message": {"role": "assistant", "content": "(cassette exhausted)"},
+                    "done": True, "eval_count": 3}
+        return json.loads(json.dumps(data))
+
+
+class ScriptResponder:
+    """Synthesizes responses from a turn script; counters mimic Ollama's."""
+
+    def __init__(self, script=None, ttft=SCRIPT_TTFT, tok_s=SCRIPT_TOK_S):
+        self.script = script or DEFAULT_SCRIPT
+        self.ttft = ttft
+        self.tok_s = tok_s
+
+    def respond(self, payload):
+        messages = payload.get("messages", [])
+        turn = _session_key(messages)[1]
+        step = self.script[min(turn, len(self.script) - 1)]
+        message = {"role": "assistant", "content": step.get("content", "")}
+        if step.get("tool_calls"):
+            message["tool_calls"] = [{"function": {"name": name, "arguments": args}}
+                                     for name, args in step["tool_calls"]]
+        prompt_tokens = sum(_tokens(json.dumps(m)) for m in messages)
+        eval_tokens = _tokens(json.dumps(message))
+        eval_ns = int(eval_tokens / self.tok_s * 1e9) if self.tok_s else 0
+        prompt_ns = int(self.ttft * 1e9)
+        return {
+            "model": payload.get("model", "mock"),
+            "message": message,
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": eval_tokens,
+            "load_duration": 0,
+            "prompt_eval_duration": prompt_ns,
+            "eval_duration": eval_ns,
+            "total_duration": prompt_ns + eval_ns,
+        }
+
+
+# ── Server ────────────────────────────────────────────────────
+
+def make_server(responder, port=11434, speed=1.0, ttft=None, tok_s=None):
+    """ThreadingHTTPServer serving responder on 127.0.0.1:port (0 = any free port).
+
+    Delays come from each response's Ollama durations times speed; ttft and
+    tok_s, when given, replace the prompt phase and the generation rate.
+    """
+
+    def delays(data):
+        prompt_s = ((data.get("load_duration") or 0) + (data.get("prompt_eval_duration") or 0)) / 1e9
+        eval_s = (data.get("eval_duration") or 0) / 1e9
+        if ttft is not None:
+            prompt_s = ttft
+        if tok_s:
+            eval_s = (data.get("eval_count") or 0) / tok_s
+        return prompt_s * speed, eval_s * speed
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # small NDJSON chunks would otherwise wait ~40ms
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, obj, status=200):
+            body = json.dumps(obj).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _chunk(self, obj):
+            data = (json.dumps(obj) + "\n").encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == "/api/version":
+                self._send_json({"version": "mock"})
+            else:
+                self._send_json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            except ValueError:
+                self._send_json({"error": "invalid JSON"}, 400)
+                return
+            if self.path == "/api/generate":
+                self._send_json({"model": payload.get("model"), "response": "hi", "done": True})
+                return
+            if self.path != "/api/chat":
+                self._send_json({"error": "not found"}, 404)
+                return
+
+            data = responder.respond(payload)
+            prompt_s, eval_s = delays(data)
+            message = data.pop("message")
+            if not payload.get("stream", True):
+                time.sleep(prompt_s + eval_s)
+                self._send_json({**data, "message": message})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            time.sleep(prompt_s)
+            words = message.get("content", "").split(" ")
+            for i, word in enumerate(words):
+                delta = word if i == len(words) - 1 else word + " "
+                self._chunk({"message": {"role": "assistant", "content": delta}, "done": False})
+                time.sleep(eval_s / len(words))
+            if message.get("tool_calls"):
+                self._chunk({"message": {"role": "assistant", "content": "",
+                                         "tool_calls": message["tool_calls"]}, "done": False})
+            self._chunk({**data, "message": {"role": "assistant", "content": ""}, "done": True})
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve_in_background(server):
+    """Start server on a daemon thread; returns its base URL."""
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def parse_responder_args(args):
+    """Pop --cassette/--script/--speed/--ttft/--tok-s from args. Returns (responder, server kwargs)."""
+
+    def pop(flag, cast=str):
+        if flag not in args:
+            return None
+        i = args.index(flag)
+        value = cast(args[i + 1])
+        del args[i:i + 2]
+        return value
+
+    cassette = pop("--cassette")
+    script = pop("--script")
+    speed = pop("--speed", float)
+    ttft = pop("--ttft", float)
+    tok_s = pop("--tok-s", float)
+    if cassette:
+        responder = CassetteResponder(cassette)
+    elif script:
+        with open(script) as f:
+            responder = ScriptResponder(json.load(f))
+    else:
+        responder = ScriptResponder()
+    return responder, {"speed": 1.0 if speed is None else speed, "ttft": ttft, "tok_s": tok_s}
+
+
+def main():
+    args = sys.argv[1:]
+    port = 11434
+    if "--port" in args:
+        i = args.index("--port")
+        port = int(args[i + 1])
+        del args[i:i + 2]
+    responder, kwargs = parse_responder_args(args)
+    server = make_server(responder, port=port, **kwargs)
+    print(f"Mock Ollama on http://127.0.0.1:{server.server_address[1]} "
+          f"({type(responder).__name__}, speed {kwargs['speed']})")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
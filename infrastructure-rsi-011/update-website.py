@@ -6,14 +6,20 @@ Docker containers, updates the RSI-011 page, builds, and pushes.
 Author: Mia 🌸 | Date: 2026-03-05
 """
 
-import subprocess, json, os, re, html
+import subprocess, json, os, re, html, sys, hashlib
 from datetime import datetime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "monitor", "scripts"))
+import docker_collect
+from docker_collect import collect, report
+
 PAGE = "/Users/miguelitodeguzman/Projects/individuationlab/website/src/pages/rsi-011/index.astro"
 WEBSITE_DIR = "/Users/miguelitodeguzman/Projects/individuationlab/website"
 REPO_DIR = "/Users/miguelitodeguzman/Projects/individuationlab"
 DATA_DIR = "/Users/miguelitodeguzman/ailab/lab-protocol/experiments/rsi-011/data"
 TRIGGER_LOG = os.path.join(DATA_DIR, "trigger.log")
+CACHE_FILE = os.path.join(DATA_DIR, "website-cache.json")
+CACHE_VERSION = 1  # bump when render_row/render_viewer markup changes
 
 SUBJECTS = ["john-a-1", "john-a-2", "john-a-3", "john-a-4",
             "john-b-1", "john-b-2", "john-b-3", "john-b-4"]
@@ -21,9 +27,9 @@ SUBJECTS = ["john-a-1", "john-a-2", "john-a-3", "john-a-4",
 
 def docker_exec(container, cmd):
     try:
-        result = subprocess.run(
+        result = docker_collect.run(
             ["docker", "exec", "--user", "subject", container, "python3", "-c", cmd],
-            capture_output=True, text=True, timeout=15
+            15, capture_output=True, text=True
         )
         return result.stdout.strip()
     except:
@@ -78,9 +84,13 @@ print(json.dumps(data))
     try:
         return json.loads(raw)
     except:
-        return {"soulLines": 0, "soulBytes": 0, "soulContent": "",
-                "journalLines": 0, "journalContent": "",
-                "totalFiles": 0, "extraFiles": [], "allFiles": []}
+        return empty_subject_data()
+
+
+def empty_subject_data():
+    return {"soulLines": 0, "soulBytes": 0, "soulContent": "",
+            "journalLines": 0, "journalContent": "",
+            "totalFiles": 0, "extraFiles": [], "allFiles": []}
 
 
 def count_sessions():
@@ -99,22 +109,11 @@ def esc(text):
     return html.escape(text, quote=True)
 
 
-def build_live_html(all_data, total_sessions, last_time):
-    now = datetime.now().strftime("%b %d, %H:%M GST")
-
-    a_soul = sum(all_data[s]["soulBytes"] for s in SUBJECTS if s.startswith("john-a"))
-    b_soul = sum(all_data[s]["soulBytes"] for s in SUBJECTS if s.startswith("john-b"))
-    a_avg = a_soul // 4 if a_soul else 0
-    b_avg = b_soul // 4 if b_soul else 0
-    ratio = ((a_avg - b_avg) * 100 // b_avg) if b_avg > 0 else 0
-
-    # Build the stats table
-    rows = ""
-    for s in SUBJECTS:
-        d = all_data[s]
-        group = "🌑 Shadow" if s.startswith("john-a") else "⚪ Control"
-        extra = ", ".join(d["extraFiles"]) if d["extraFiles"] else "—"
-        rows += f"""
+def render_row(s, d):
+    """Stats-table row for one subject."""
+    group = "🌑 Shadow" if s.startswith("john-a") else "⚪ Control"
+    extra = ", ".join(d["extraFiles"]) if d["extraFiles"] else "—"
+    return f"""
             <tr>
               <td class="mono">{s}</td>
               <td>{group}</td>
@@ -124,21 +123,20 @@ def build_live_html(all_data, total_sessions, last_time):
               <td>{extra}</td>
             </tr>"""
 
-    # Build file viewer for each subject
-    file_viewers = ""
-    for s in SUBJECTS:
-        d = all_data[s]
-        group_class = "shadow" if s.startswith("john-a") else "control"
-        group_label = "🌑 Shadow Seed" if s.startswith("john-a") else "⚪ Control"
 
-        # File tree
-        file_tree = "\n".join(f"  {f}" for f in d.get("allFiles", []))
+def render_viewer(s, d):
+    """File viewer block (tree, SOUL.md, journal.md) for one subject."""
+    group_class = "shadow" if s.startswith("john-a") else "control"
+    group_label = "🌑 Shadow Seed" if s.startswith("john-a") else "⚪ Control"
 
-        # SOUL.md content
-        soul_content = esc(d.get("soulContent", "(empty)"))
-        journal_content = esc(d.get("journalContent", "(empty)"))
+    # File tree
+    file_tree = "\n".join(f"  {f}" for f in d.get("allFiles", []))
 
-        file_viewers += f"""
+    # SOUL.md content
+    soul_content = esc(d.get("soulContent", "(empty)"))
+    journal_content = esc(d.get("journalContent", "(empty)"))
+
+    return f"""
       <div class="subject-files {group_class}-files">
         <div class="sf-header">
           <span class="sf-name">{s}</span>
@@ -159,6 +157,20 @@ def build_live_html(all_data, total_sessions, last_time):
         </details>
       </div>"""
 
+
+def build_live_html(all_data, total_sessions, last_time, fragments):
+    """Assemble the live block. `fragments` maps subject → {"row", "viewer"} HTML."""
+    now = datetime.now().strftime("%b %d, %H:%M GST")
+
+    a_soul = sum(all_data[s]["soulBytes"] for s in SUBJECTS if s.startswith("john-a"))
+    b_soul = sum(all_data[s]["soulBytes"] for s in SUBJECTS if s.startswith("john-b"))
+    a_avg = a_soul // 4 if a_soul else 0
+    b_avg = b_soul // 4 if b_soul else 0
+    ratio = ((a_avg - b_avg) * 100 // b_avg) if b_avg > 0 else 0
+
+    rows = "".join(fragments[s]["row"] for s in SUBJECTS)
+    file_viewers = "".join(fragments[s]["viewer"] for s in SUBJECTS)
+
     out = f"""<div class="live-data">
         <h3>📡 Live Progress — {total_sessions} Sessions Completed</h3>
         <p class="live-updated">Last updated: {now}</p>
@@ -185,6 +197,38 @@ def build_live_html(all_data, total_sessions, last_time):
     return out
 
 
+# ── Fingerprint cache ─────────────────────────────────────────
+# Remembers what each subject's data looked like at the last page write, so
+# an update where nothing changed skips rendering and the Astro build, and
+# an update where some subjects changed only re-renders their fragments.
+
+def fingerprint(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+
+
+def load_cache():
+    try:
+        with open(CACHE_FILE) as f:
+            cache = json.load(f)
+        if cache.get("version") == CACHE_VERSION:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {"version": CACHE_VERSION, "subjects": {}}
+
+
+def save_cache(cache):
+    tmp = CACHE_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp, CACHE_FILE)
+
+
+def live_block(content):
+    m = re.search(r"<!-- LIVE_DATA_START -->.*?<!-- LIVE_DATA_END -->", content, flags=re.DOTALL)
+    return m.group(0) if m else ""
+
+
 def update_page(live_html, total_sessions, last_time):
     with open(PAGE) as f:
         content = f.read()
@@ -226,18 +270,57 @@ def build_and_push():
 
 
 def main():
+    results, errors = collect(SUBJECTS, get_subject_data, timeout=60)
     all_data = {}
     for s in SUBJECTS:
-        all_data[s] = get_subject_data(s)
+        all_data[s] = results.get(s) or empty_subject_data()
+        if s in errors:
+            print(f"  {s}: ⚠️ {errors[s]}")
+            continue
         print(f"  {s}: SOUL {all_data[s]['soulLines']}L/{all_data[s]['soulBytes']}B, "
               f"journal {all_data[s]['journalLines']}L, "
               f"files {all_data[s]['totalFiles']}")
+    print(f"  {report(results, errors, len(SUBJECTS))}")
 
     total_sessions, last_time = count_sessions()
     print(f"  Sessions: {total_sessions}, last: {last_time}")
 
-    live_html = build_live_html(all_data, total_sessions, last_time)
+    cache = load_cache()
+    prints = {s: fingerprint(all_data[s]) for s in SUBJECTS}
+    changed_subjects = [s for s in SUBJECTS
+                        if cache["subjects"].get(s, {}).get("fingerprint") != prints[s]]
+    try:
+        with open(PAGE) as f:
+            page_block = live_block(f.read())
+    except OSError:
+        page_block = ""
+    # The page itself may have been reset (checkout, manual edit) since we last wrote it
+    page_intact = fingerprint(page_block) == cache.get("page_block")
+
+    if (not changed_subjects and page_intact
+            and cache.get("sessions") == [total_sessions, last_time]):
+        print("No subject data changed — skipping render and build")
+        return
+
+    fragments = {}
+    for s in SUBJECTS:
+        entry = cache["subjects"].get(s)
+        if s in changed_subjects or not entry:
+            entry = {"fingerprint": prints[s],
+                     "row": render_row(s, all_data[s]),
+                     "viewer": render_viewer(s, all_data[s])}
+            cache["subjects"][s] = entry
+        fragments[s] = entry
+    print(f"  Re-rendered: {', '.join(changed_subjects) or 'none (session count only)'}")
+
+    live_html = build_live_html(all_data, total_sessions, last_time, fragments)
     changed = update_page(live_html, total_sessions, last_time)
+
+    with open(PAGE) as f:
+        cache["page_block"] = fingerprint(live_block(f.read()))
+    cache["sessions"] = [total_sessions, last_time]
+    save_cache(cache)
+
     if changed:
         print("Page updated")
         build_and_push()
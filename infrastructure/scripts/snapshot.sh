@@ -39,9 +39,16 @@ for SUBJECT in john-a john-b; do
   done
   echo "  ✅ Key files captured"
   
-  # Capture session logs
-  docker exec "$CONTAINER" sh -c "cat /workspace/logs/*.json 2>/dev/null" > "$DATA_DIR/$SUBJECT/session-logs.json" 2>/dev/null || true
-  echo "  ✅ Session logs captured"
+  # Capture session logs (JSONL, one file per session; concatenated they are
+  # still JSONL, each session starting with its session_id header line).
+  # Blob references resolve against logs/.blobs in workspace.tar.gz.
+  docker exec "$CONTAINER" sh -c "cat /workspace/logs/*.jsonl 2>/dev/null" > "$DATA_DIR/$SUBJECT/session-logs.jsonl" 2>/dev/null || true
+  SESSIONS=$(grep -c '^{"session_id"' "$DATA_DIR/$SUBJECT/session-logs.jsonl" 2>/dev/null)
+  if [ "${SESSIONS:-0}" -gt 0 ]; then
+    echo "  ✅ Session logs captured ($SESSIONS session(s))"
+  else
+    echo "  ⚠️ No session transcript found in /workspace/logs/*.jsonl"
+  fi
   
   # Capture file listing with hashes
   docker exec "$CONTAINER" sh -c 'find /workspace -type f -not -path "*/logs/*" -exec md5sum {} \;' > "$DATA_DIR/$SUBJECT/file-hashes.txt" 2>/dev/null || true
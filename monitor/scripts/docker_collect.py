@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Concurrent per-container collection for the site snapshot scripts.
+Runs one collector per subject on a thread pool so total collection time
+is bounded by the slowest container instead of the sum of all of them,
+plus a batched status/stats inventory of all subject containers.
+
+Used by monitor/scripts/snapshot-direct.py and
+infrastructure-rsi-011/update-website.py.
+
+Author: Mia 🌸
+"""
+
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+_round = threading.local()  # deadline of the collect() round this worker thread belongs to
+
+
+def run(args, timeout, **kwargs):
+    """subprocess.run for collectors: timeout is clamped to what is left of
+    the current collect() round, so no docker call outlives its deadline.
+    Past the deadline it raises TimeoutExpired without starting anything."""
+    deadline = getattr(_round, 'deadline', None)
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            raise subprocess.TimeoutExpired(args, 0)
+    return subprocess.run(args, timeout=timeout, **kwargs)
+
+
+def collect(subjects, fn, timeout=60, max_workers=None):
+    """Run fn(subject) for every subject concurrently.
+
+    Returns (results, errors):
+      results — {subject: fn(subject)} for collectors that finished in time
+      errors  — {subject: reason} for collectors that raised or overran
+
+    `timeout` bounds the whole collection. Collectors must run their docker
+    calls through run(), which caps each one at the round's deadline, so
+    overrunning collectors stop within moments of it rather than lingering
+    (and holding up interpreter exit). They are reported as 'timeout after
+    Ns' — the caller still gets every result that did come back.
+    """
+    subjects = list(subjects)
+    results, errors = {}, {}
+    if not subjects:
+        return results, errors
+
+    pool = ThreadPoolExecutor(max_workers=max_workers or len(subjects))
+    start = time.time()
+    deadline = time.monotonic() + timeout
+
+    def bounded(subject):
+        _round.deadline = deadline
+        try:
+            return fn(subject)
+        finally:
+            _round.deadline = None
+
+    try:
+        futures = {pool.submit(bounded, s): s for s in subjects}
+        done, pending = wait(futures, timeout=timeout)
+        for fut in done:
+            subject = futures[fut]
+            try:
+                results[subject] = fut.result()
+            except Exception as e:
+                errors[subject] = f"{type(e).__name__}: {e}"
+        for fut in pending:
+            fut.cancel()
+            errors[futures[fut]] = f"timeout after {time.time() - start:.0f}s"
+    finally:
+        # Collectors past the deadline are killing their last docker call
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    return results, errors
+
+
+def report(results, errors, total):
+    """One-line summary of a collection round."""
+    line = f"Collected {len(results)}/{total} subjects"
+    if errors:
+        line += " — missing: " + ", ".join(f"{s} ({why})" for s, why in sorted(errors.items()))
+    return line
+
+
+def container_inventory(subjects, prefix):
+    """Status + resource stats for all subjects in two docker calls.
+
+    One `docker ps` lists every container named {prefix}{subject}; one
+    `docker stats --no-stream` samples all the running ones together (the
+    ~2s sampling window is paid once, not once per subject). Returns
+    {subject: {'running': bool, 'status': str, 'resources': dict|None}}.
+    """
+    names = {f'{prefix}{s}': s for s in subjects}
+    inventory = {s: {'running': False, 'status': '', 'resources': None} for s in subjects}
+
+    try:
+        result = subprocess.run(
+            ['docker', 'ps', '--all', '--filter', f'name={prefix}', '--format', '{{.Names}}|{{.Status}}'],
+            capture_output=True, text=True, timeout=10
+        )
+        for line in result.stdout.splitlines():
+            name, _, status = line.partition('|')
+            subject = names.get(name.strip())
+            if subject:
+                inventory[subject]['status'] = status.strip()
+                inventory[subject]['running'] = status.strip().startswith('Up')
+    except Exception:
+        return inventory
+
+    running = [f'{prefix}{s}' for s, info in inventory.items() if info['running']]
+    if not running:
+        return inventory
+
+    try:
+        result = subprocess.run(
+            ['docker', 'stats', '--no-stream', '--format',
+             '{{.Name}}|{{.CPUPerc}}|{{.MemUsage}}|{{.NetIO}}', *running],
+            capture_output=True, text=True, timeout=20
+        )
+        for line in result.stdout.splitlines():
+            parts = line.split('|')
+            subject = names.get(parts[0].strip())
+            if subject and len(parts) >= 4:
+                inventory[subject]['resources'] = {
+                    'cpu': parts[1].strip(), 'mem': parts[2].strip(), 'net': parts[3].strip()
+                }
+    except Exception:
+        pass
+
+    return inventory
@@ -14,9 +14,13 @@ import subprocess
 import sys
 from datetime import datetime, timezone
 
+import docker_collect
+from docker_collect import collect, container_inventory, report
+
 SITE_DIR = "/Users/miguelitodeguzman/Projects/individuationlab/website/public/rsi"
 REPO_DIR = "/Users/miguelitodeguzman/Projects/individuationlab"
 CONTAINER_PREFIX = "lab-"
+COLLECT_TIMEOUT = 90  # seconds for the whole (concurrent) collection
 
 SUBJECTS = [
     'john-a-1', 'john-b-1',
@@ -30,42 +34,14 @@ SUBJECTS = [
 def docker_exec(container, cmd, timeout=10):
     """Run a command inside a Docker container."""
     try:
-        result = subprocess.run(
+        result = docker_collect.run(
             ['docker', 'exec', container, 'sh', '-c', cmd],
-            capture_output=True, text=True, timeout=timeout
+            timeout, capture_output=True, text=True
         )
         return result.stdout.strip() if result.returncode == 0 else None
     except Exception:
         return None
 
-def is_running(subject):
-    """Check if container is running."""
-    try:
-        result = subprocess.run(
-            ['docker', 'ps', '--filter', f'name={CONTAINER_PREFIX}{subject}', '--format', '{{.Status}}'],
-            capture_output=True, text=True, timeout=5
-        )
-        return 'Up' in (result.stdout or '')
-    except Exception:
-        return False
-
-def get_stats(subject):
-    """Get container resource stats."""
-    try:
-        result = subprocess.run(
-            ['docker', 'stats', '--no-stream', '--format',
-             '{{.CPUPerc}}|{{.MemUsage}}|{{.NetIO}}',
-             f'{CONTAINER_PREFIX}{subject}'],
-            capture_output=True, text=True, timeout=10
-        )
-        if result.returncode == 0 and result.stdout.strip():
-            parts = result.stdout.strip().split('|')
-            if len(parts) >= 3:
-                return {'cpu': parts[0].strip(), 'mem': parts[1].strip(), 'net': parts[2].strip()}
-    except Exception:
-        pass
-    return None
-
 def get_files(subject):
     """Get file listing from container workspace."""
     container = f'{CONTAINER_PREFIX}{subject}'
@@ -100,35 +76,123 @@ def get_files(subject):
     
     return files
 
+# Runs inside the container: walks /workspace once and prints one JSON line
+# per file. Same file set and fields as get_files(), without spawning
+# find/wc/head for every file.
+HARVEST_SCRIPT = r"""
+import json, os, stat, sys
+CAP = 10240
+for root, dirs, names in os.walk('/workspace'):
+    dirs[:] = [d for d in dirs if d not in ('node_modules', '.git')]
+    for name in names:
+        path = os.path.join(root, name)
+        try:
+            st = os.lstat(path)
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            size = lines = 0
+            head = b''
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(65536)
+                    if not chunk:
+                        break
+                    if len(head) < CAP:
+                        head += chunk[:CAP - len(head)]
+                    size += len(chunk)
+                    lines += chunk.count(b'\n')
+        except OSError:
+            continue
+        sys.stdout.write(json.dumps({
+            'path': os.path.relpath(path, '/workspace'),
+            'size': size,
+            'lineCount': lines,
+            'content': head.decode('utf-8', 'replace').strip(),
+        }) + '\n')
+"""
+
+def get_files_bulk(subject, timeout=60):
+    """Get file listing + contents with a single docker exec.
+
+    Returns (files, truncated), or None if the harvester could not run at all
+    (e.g. no python3 in the container), so the caller can fall back to
+    get_files(). On timeout, the files streamed back so far are returned with
+    truncated=True.
+    """
+    truncated = False
+    container = f'{CONTAINER_PREFIX}{subject}'
+    try:
+        result = docker_collect.run(
+            ['docker', 'exec', container, 'python3', '-c', HARVEST_SCRIPT],
+            timeout, capture_output=True
+        )
+        if result.returncode != 0:
+            return None
+        output = result.stdout
+    except subprocess.TimeoutExpired as e:
+        output = e.stdout or b''
+        truncated = True
+    except Exception:
+        return None
+
+    files = []
+    for line in output.decode('utf-8', 'replace').split('\n'):
+        try:
+            files.append(json.loads(line))
+        except ValueError:
+            continue  # blank or torn last line
+    return files, truncated
+
+def scan_subject(subject, container):
+    """Collect status + inventory for one subject. Runs on the collection pool.
+
+    `container` is the subject's entry from container_inventory().
+    """
+    if not container['running']:
+        return {'status': 'offline'}, {'files': []}
+
+    stats = container['resources']
+    harvest = get_files_bulk(subject)
+    files, truncated = harvest if harvest is not None else (get_files(subject), False)
+
+    status = {
+        'status': 'online',
+        'lastSeen': datetime.now(timezone.utc).isoformat(),
+        'fileCount': len(files),
+        'sessionCount': 0,
+        'resources': stats,
+    }
+    if truncated:
+        status['partial'] = True  # harvest timed out: fileCount/inventory are incomplete
+    return status, {'files': files}
+
 def main():
     push = "--push" in sys.argv
     print("📸 Snapshotting RSI-001 data for website (N=6, direct mode)...")
 
+    containers = container_inventory(SUBJECTS, CONTAINER_PREFIX)
+    results, errors = collect(
+        SUBJECTS, lambda s: scan_subject(s, containers[s]), timeout=COLLECT_TIMEOUT
+    )
+
     subjects_status = {}
     inventory = {}
-
     for subject in SUBJECTS:
-        print(f"  Scanning {subject}...", end=' ', flush=True)
-        running = is_running(subject)
-        
-        if not running:
-            subjects_status[subject] = {'status': 'offline'}
+        if subject in results:
+            subjects_status[subject], inventory[subject] = results[subject]
+            status = subjects_status[subject]
+            if status.get('partial'):
+                print(f"  {subject}: ⚠️ online ({status['fileCount']} files, partial: harvest timed out)")
+            elif status['status'] == 'online':
+                print(f"  {subject}: online ({status['fileCount']} files)")
+            else:
+                print(f"  {subject}: offline")
+        else:
+            # Keep partial results: an unreachable subject shouldn't sink the snapshot
+            subjects_status[subject] = {'status': 'unknown', 'error': errors[subject]}
             inventory[subject] = {'files': []}
-            print("offline")
-            continue
-        
-        stats = get_stats(subject)
-        files = get_files(subject)
-        
-        subjects_status[subject] = {
-            'status': 'online',
-            'lastSeen': datetime.now(timezone.utc).isoformat(),
-            'fileCount': len(files),
-            'sessionCount': 0,
-            'resources': stats,
-        }
-        inventory[subject] = {'files': files}
-        print(f"online ({len(files)} files)")
+            print(f"  {subject}: ⚠️ {errors[subject]}")
+    print(f"  {report(results, errors, len(SUBJECTS))}")
 
     # Build snapshot
     shadow_ids = sorted([s for s in SUBJECTS if '-a-' in s])